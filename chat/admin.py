@@ -1,8 +1,32 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db.models import Count
+from django.db.models.functions import Substr
 from .models import User, Lobby, LobbyMembership, LobbyBan, Message, LobbyEvent
 
 
+class TextPreviewMixin:
+    """Build list previews from a DB-side substring instead of the full text column"""
+    preview_field = None
+    preview_length = 50
+    
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request).annotate(
+            _preview=Substr(self.preview_field, 1, self.preview_length + 1)
+        )
+        # Only the changelist can skip the full column; change forms need it
+        match = request.resolver_match
+        if match and match.url_name and match.url_name.endswith('_changelist'):
+            queryset = queryset.defer(self.preview_field)
+        return queryset
+    
+    def text_preview(self, obj):
+        preview = obj._preview
+        if preview and len(preview) > self.preview_length:
+            return preview[:self.preview_length] + '...'
+        return preview
+
+
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
     """User admin with premium status"""
@@ -45,7 +69,8 @@ class LobbyBanInline(admin.TabularInline):
 @admin.register(Lobby)
 class LobbyAdmin(admin.ModelAdmin):
     """Lobby admin"""
-    list_display = ('name', 'owner', 'status', 'is_public', 'current_participants_count', 'max_participants', 'created_at')
+    list_display = ('name', 'owner', 'status', 'is_public', 'participants', 'max_participants', 'created_at')
+    list_select_related = ('owner',)
     list_filter = ('status', 'is_public', 'created_at')
     search_fields = ('name', 'owner__username')
     readonly_fields = ('created_at', 'updated_at', 'current_participants_count')
@@ -69,12 +94,36 @@ class LobbyAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_pcount=Count('memberships'))
+    
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not LobbyMembership:
+            return super().save_formset(request, form, formset, change)
+        
+        # Lobby.save() already created the owner's membership, so a new
+        # inline row for the owner would break the (user, lobby) constraint
+        memberships = formset.save(commit=False)
+        for membership in formset.deleted_objects:
+            membership.delete()
+        for membership in memberships:
+            if membership.pk is None and membership.user_id == form.instance.owner_id:
+                continue
+            membership.save()
+        formset.save_m2m()
+    
+    def participants(self, obj):
+        return obj._pcount
+    participants.short_description = 'Participants'
+    participants.admin_order_field = '_pcount'
 
 
 @admin.register(LobbyMembership)
 class LobbyMembershipAdmin(admin.ModelAdmin):
     """Lobby membership admin"""
     list_display = ('user', 'lobby', 'role', 'joined_at')
+    list_select_related = ('user', 'lobby__owner')
     list_filter = ('role', 'joined_at')
     search_fields = ('user__username', 'lobby__name')
     readonly_fields = ('joined_at',)
@@ -82,34 +131,36 @@ class LobbyMembershipAdmin(admin.ModelAdmin):
 
 
 @admin.register(LobbyBan)
-class LobbyBanAdmin(admin.ModelAdmin):
+class LobbyBanAdmin(TextPreviewMixin, admin.ModelAdmin):
     """Lobby ban admin"""
     list_display = ('user', 'lobby', 'banned_by', 'created_at', 'reason_preview')
+    list_select_related = ('user', 'lobby__owner', 'banned_by')
     list_filter = ('created_at',)
     search_fields = ('user__username', 'lobby__name', 'banned_by__username')
     readonly_fields = ('created_at',)
     ordering = ('-created_at',)
+    preview_field = 'reason'
     
     def reason_preview(self, obj):
-        if obj.reason:
-            return obj.reason[:50] + '...' if len(obj.reason) > 50 else obj.reason
-        return '-'
+        return self.text_preview(obj) or '-'
     reason_preview.short_description = 'Reason'
 
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(TextPreviewMixin, admin.ModelAdmin):
     """Message admin"""
     list_display = ('sender', 'lobby', 'content_preview', 'created_at', 'is_deleted')
+    list_select_related = ('sender', 'lobby__owner')
     list_filter = ('is_deleted', 'created_at')
     search_fields = ('sender__username', 'lobby__name', 'content')
     readonly_fields = ('created_at',)
     ordering = ('-created_at',)
+    preview_field = 'content'
     
     actions = ['mark_deleted', 'mark_not_deleted']
     
     def content_preview(self, obj):
-        return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
+        return self.text_preview(obj)
     content_preview.short_description = 'Content'
     
     def mark_deleted(self, request, queryset):
@@ -124,16 +175,18 @@ class MessageAdmin(admin.ModelAdmin):
 
 
 @admin.register(LobbyEvent)
-class LobbyEventAdmin(admin.ModelAdmin):
+class LobbyEventAdmin(TextPreviewMixin, admin.ModelAdmin):
     """Lobby event admin"""
     list_display = ('lobby', 'event_type', 'actor', 'target', 'created_at', 'description_preview')
+    list_select_related = ('lobby__owner', 'actor', 'target')
     list_filter = ('event_type', 'created_at')
     search_fields = ('lobby__name', 'actor__username', 'target__username', 'description')
     readonly_fields = ('created_at',)
     ordering = ('-created_at',)
+    preview_field = 'description'
     
     def description_preview(self, obj):
-        return obj.description[:50] + '...' if len(obj.description) > 50 else obj.description
+        return self.text_preview(obj)
     description_preview.short_description = 'Description'
 
 
@@ -0,0 +1,23 @@
+"""Cache keys, channel names and timeouts shared by the WebSocket consumer, views and model signals"""
+
+# Channel served by MessageWriterConsumer (python manage.py runworker db-writes)
+MESSAGE_WRITER_CHANNEL = 'db-writes'
+
+# Timeout policy (seconds)
+SHORT_TIMEOUT = 5    # per-user decisions, e.g. can this user join
+MEMBER_TIMEOUT = 60  # membership flags, dropped by signals on every change
+NORMAL_TIMEOUT = 30  # shared objects, e.g. the lobby row
+
+
+def lobby_key(lobby_id):
+    return f'lobby:{lobby_id}'
+
+
+def can_join_key(lobby_id, user_id, status):
+    # The lobby status is part of the key, so start/close retire every
+    # cached decision for the old status without per-user deletes
+    return f'canjoin:{lobby_id}:{status}:{user_id}'
+
+
+def membership_key(lobby_id, user_id):
+    return f'lobbymember:{lobby_id}:{user_id}'
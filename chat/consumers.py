@@ -1,12 +1,30 @@
-import json
-import asyncio
+import orjson
+import time
+import uuid
 from typing import Dict, Any
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.consumer import SyncConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-from datetime import datetime, timedelta
-from .models import User, Lobby, LobbyMembership, LobbyBan, Message
+from django_redis import get_redis_connection
+from .models import Lobby, Message, LobbyEvent, is_lobby_member
+from .cache_keys import SHORT_TIMEOUT, NORMAL_TIMEOUT, lobby_key, can_join_key
+from .db_writes import queue_or_write
+
+
+def get_redis():
+    """Raw Redis client of the default cache, or None when it is not django-redis.
+    
+    Without REDIS_URL the default cache is LocMem, and presence, rate limiting
+    and typing debounce fall back to the cache API (per process, not atomic).
+    """
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
 
 
 class LobbyConsumer(AsyncWebsocketConsumer):
@@ -18,10 +36,15 @@ class LobbyConsumer(AsyncWebsocketConsumer):
         self.lobby_group_name = None
         self.user = None
         self.lobby = None
+        # Set once an authenticated user passed the join checks and was
+        # added to presence; rejected sockets have nothing to clean up
+        self.presence_added = False
         
     async def connect(self):
         """Handle WebSocket connection"""
-        self.lobby_id = self.scope['url_route']['kwargs']['lobby_id']
+        # Cache keys are built from the int id, as chat.signals deletes them;
+        # the URL string may carry leading zeros ("007")
+        self.lobby_id = int(self.scope['url_route']['kwargs']['lobby_id'])
         self.lobby_group_name = f'lobby_{self.lobby_id}'
         self.user = self.scope['user']
         
@@ -54,42 +77,37 @@ class LobbyConsumer(AsyncWebsocketConsumer):
         
         # Add user to online presence
         await self.add_user_presence()
+        self.presence_added = True
         
         # Notify others that user joined
-        await self.channel_layer.group_send(
-            self.lobby_group_name,
-            {
-                'type': 'presence_join',
-                'user_id': self.user.id,
-                'username': self.user.username,
-                'is_premium': self.user.is_premium,
-            }
-        )
+        await self.group_send_json({
+            'type': 'presence_join',
+            'user_id': self.user.id,
+            'username': self.user.username,
+            'is_premium': self.user.is_premium,
+        })
         
         # Send current online users to new user
         online_users = await self.get_online_users()
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'presence_list',
             'users': online_users
-        }))
+        })
     
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
-        if hasattr(self, 'lobby_group_name') and self.lobby_group_name:
+        if self.presence_added and self.user.is_authenticated:
             # Remove user from online presence
             await self.remove_user_presence()
             
             # Notify others that user left
-            if self.user and self.user.is_authenticated:
-                await self.channel_layer.group_send(
-                    self.lobby_group_name,
-                    {
-                        'type': 'presence_leave',
-                        'user_id': self.user.id,
-                        'username': self.user.username,
-                    }
-                )
-            
+            await self.group_send_json({
+                'type': 'presence_leave',
+                'user_id': self.user.id,
+                'username': self.user.username,
+            })
+        
+        if self.lobby_group_name:
             # Leave lobby group
             await self.channel_layer.group_discard(
                 self.lobby_group_name,
@@ -99,7 +117,7 @@ class LobbyConsumer(AsyncWebsocketConsumer):
     async def receive(self, text_data):
         """Handle received WebSocket message"""
         try:
-            data = json.loads(text_data)
+            data = orjson.loads(text_data)
             message_type = data.get('type')
             
             if message_type == 'chat_message':
@@ -111,7 +129,7 @@ class LobbyConsumer(AsyncWebsocketConsumer):
             else:
                 await self.send_error('Unknown message type')
                 
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             await self.send_error('Invalid JSON')
         except Exception as e:
             await self.send_error(f'Error processing message: {str(e)}')
@@ -133,161 +151,176 @@ class LobbyConsumer(AsyncWebsocketConsumer):
             await self.send_error('Rate limit exceeded. Please slow down.')
             return
         
-        # Check if user is still a member
-        is_member = await self.is_user_member()
-        if not is_member:
+        # Check if user is a member on every message; the cached flag is
+        # dropped by chat.signals on leave, kick and ban, so a user who left
+        # over REST can't keep sending on an open socket
+        if not await self.is_user_member():
             await self.send_error('You are not a member of this lobby')
             await self.close(code=4003)
             return
         
-        # Save message to database
-        message = await self.save_message(content)
-        if not message:
-            await self.send_error('Failed to save message')
-            return
+        # Hand the INSERT to the db-writes worker and broadcast straight away.
+        # A queued message has no database id yet; clients match the follow-up
+        # message_saved event on client_id. When no worker can take it the
+        # message is stored here and broadcast with its id.
+        client_id = uuid.uuid4().hex
+        message = await self.save_message(content, client_id)
+        created_at = message.created_at if message else timezone.now()
         
         # Broadcast message to lobby group
-        await self.channel_layer.group_send(
-            self.lobby_group_name,
-            {
-                'type': 'chat_message',
-                'message': {
-                    'id': message.id,
-                    'content': message.content,
-                    'sender': {
-                        'id': self.user.id,
-                        'username': self.user.username,
-                        'is_premium': self.user.is_premium,
-                    },
-                    'created_at': message.created_at.isoformat(),
-                }
+        await self.group_send_json({
+            'type': 'chat_message',
+            'message': {
+                'id': message.id if message else None,
+                'client_id': client_id,
+                'content': content,
+                'sender': {
+                    'id': self.user.id,
+                    'username': self.user.username,
+                    'is_premium': self.user.is_premium,
+                },
+                'created_at': created_at.isoformat(),
             }
-        )
+        })
     
     async def handle_typing_start(self):
         """Handle typing start event"""
-        await self.channel_layer.group_send(
-            self.lobby_group_name,
-            {
-                'type': 'typing_start',
-                'user_id': self.user.id,
-                'username': self.user.username,
-            }
-        )
+        # Debounce: forward at most one typing_start per user every 400ms
+        if not await self.claim_typing_slot():
+            return
+        
+        await self.group_send_json({
+            'type': 'typing_start',
+            'user_id': self.user.id,
+            'username': self.user.username,
+        }, user_id=self.user.id)
     
     async def handle_typing_stop(self):
         """Handle typing stop event"""
-        await self.channel_layer.group_send(
-            self.lobby_group_name,
-            {
-                'type': 'typing_stop',
-                'user_id': self.user.id,
-                'username': self.user.username,
-            }
-        )
+        # Let the next typing_start through straight away
+        await self.release_typing_slot()
+        
+        await self.group_send_json({
+            'type': 'typing_stop',
+            'user_id': self.user.id,
+            'username': self.user.username,
+        }, user_id=self.user.id)
     
     async def chat_message(self, event):
         """Send chat message to WebSocket"""
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': event['message']
-        }))
+        await self.send(text_data=event['payload'])
+    
+    async def message_saved(self, event):
+        """Send database id of a persisted chat message to WebSocket"""
+        await self.send(text_data=event['payload'])
     
     async def presence_join(self, event):
         """Send presence join event to WebSocket"""
-        await self.send(text_data=json.dumps({
-            'type': 'presence_join',
-            'user_id': event['user_id'],
-            'username': event['username'],
-            'is_premium': event['is_premium'],
-        }))
+        await self.send(text_data=event['payload'])
     
     async def presence_leave(self, event):
         """Send presence leave event to WebSocket"""
-        await self.send(text_data=json.dumps({
-            'type': 'presence_leave',
-            'user_id': event['user_id'],
-            'username': event['username'],
-        }))
+        await self.send(text_data=event['payload'])
     
     async def typing_start(self, event):
         """Send typing start event to WebSocket"""
-        # Don't send typing events back to the sender
-        if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'typing_start',
-                'user_id': event['user_id'],
-                'username': event['username'],
-            }))
+        # Don't send typing events back to the sender; this is the first
+        # thing checked so the sender's own copy costs one comparison
+        if event['user_id'] == self.user.id:
+            return
+        await self.send(text_data=event['payload'])
     
     async def typing_stop(self, event):
         """Send typing stop event to WebSocket"""
-        # Don't send typing events back to the sender
-        if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'typing_stop',
-                'user_id': event['user_id'],
-                'username': event['username'],
-            }))
+        if event['user_id'] == self.user.id:
+            return
+        await self.send(text_data=event['payload'])
     
     async def moderation_kick(self, event):
         """Handle user kicked event"""
         if event['target_id'] == self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'type': 'moderation_kick',
                 'reason': event.get('reason', ''),
                 'message': 'You have been kicked from the lobby'
-            }))
+            })
             await self.close(code=4003)
         else:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'type': 'moderation_kick',
                 'target_id': event['target_id'],
                 'target_username': event.get('target_username', ''),
                 'reason': event.get('reason', ''),
-            }))
+            })
     
     async def moderation_ban(self, event):
         """Handle user banned event"""
         if event['target_id'] == self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'type': 'moderation_ban',
                 'reason': event.get('reason', ''),
                 'message': 'You have been banned from the lobby'
-            }))
+            })
             await self.close(code=4003)
         else:
-            await self.send(text_data=json.dumps({
+            await self.send_json({
                 'type': 'moderation_ban',
                 'target_id': event['target_id'],
                 'target_username': event.get('target_username', ''),
                 'reason': event.get('reason', ''),
-            }))
+            })
     
     async def system_status(self, event):
         """Handle lobby status change event"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'system_status',
             'status': event['status'],
             'message': event.get('message', ''),
-        }))
+        })
+    
+    async def send_json(self, content: Dict[str, Any]):
+        """Encode content with orjson and send it as a text frame"""
+        await self.send(text_data=orjson.dumps(content).decode())
+    
+    async def group_send_json(self, content: Dict[str, Any], **extra):
+        """Encode content once and fan the frame out to the lobby group"""
+        # Receivers forward event['payload'] as-is instead of re-encoding it
+        await self.channel_layer.group_send(
+            self.lobby_group_name,
+            {
+                'type': content['type'],
+                'payload': orjson.dumps(content).decode(),
+                **extra,
+            }
+        )
     
     async def send_error(self, message: str):
         """Send error message to client"""
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'error',
             'message': message
-        }))
+        })
     
     # Database operations
     
     @database_sync_to_async
     def get_lobby(self):
         """Get lobby object"""
+        cache_key = lobby_key(self.lobby_id)
+        lobby = cache.get(cache_key)
+        if lobby is not None:
+            return lobby
+        
         try:
-            return Lobby.objects.get(id=self.lobby_id)
+            # can_join only reads these columns
+            lobby = Lobby.objects.only(
+                'id', 'owner_id', 'is_public', 'status', 'max_participants'
+            ).get(id=self.lobby_id)
         except Lobby.DoesNotExist:
             return None
+        
+        cache.set(cache_key, lobby, timeout=NORMAL_TIMEOUT)
+        return lobby
     
     @database_sync_to_async
     def can_user_join(self):
@@ -295,82 +328,191 @@ class LobbyConsumer(AsyncWebsocketConsumer):
         if not self.lobby:
             return False, "Lobby not found"
         
-        return self.lobby.can_join(self.user)
+        # can_join is the newcomer check and refuses existing members with
+        # "Already in lobby"; members of an open lobby may always connect
+        if self.lobby.status == 'open' and is_lobby_member(self.lobby_id, self.user.id):
+            return True, "Can join"
+        
+        # Invalidated by chat.signals when the user joins, leaves or is banned
+        return cache.get_or_set(
+            can_join_key(self.lobby_id, self.user.id, self.lobby.status),
+            lambda: self.lobby.can_join(self.user),
+            timeout=SHORT_TIMEOUT
+        )
     
     @database_sync_to_async
     def is_user_member(self):
         """Check if user is a member of the lobby"""
-        return LobbyMembership.objects.filter(
-            user=self.user,
-            lobby=self.lobby
-        ).exists()
+        return is_lobby_member(self.lobby_id, self.user.id)
     
     @database_sync_to_async
-    def save_message(self, content: str):
-        """Save message to database"""
-        try:
-            message = Message.objects.create(
-                lobby=self.lobby,
-                sender=self.user,
-                content=content
-            )
-            return message
-        except Exception:
-            return None
+    def save_message(self, content, client_id):
+        """Queue the message for the db-writes worker, or store and return it here"""
+        fields = {
+            'lobby_id': self.lobby.id,
+            'sender_id': self.user.id,
+            'content': content,
+        }
+        return queue_or_write(
+            'save_message',
+            {**fields, 'client_id': client_id},
+            lambda: Message.objects.create(**fields)
+        )
     
-    # Rate limiting
+    # Rate limiting, typing debounce and presence: blocking Redis
+    # round-trips, so they run in a worker thread instead of on the event loop
     
-    async def check_rate_limit(self):
-        """Check if user has exceeded rate limit"""
+    @sync_to_async(thread_sensitive=False)
+    def check_rate_limit(self):
+        """Check if user has exceeded rate limit (3 messages per 2 seconds)"""
         cache_key = f'rate_limit:user:{self.user.id}:lobby:{self.lobby_id}'
-        current_time = timezone.now()
+        now = time.time()
         
-        # Get current message timestamps
-        messages = cache.get(cache_key, [])
+        redis = get_redis()
+        if redis is None:
+            window = [sent for sent in cache.get(cache_key, []) if sent > now - 2]
+            if len(window) >= 3:
+                return False
+            cache.set(cache_key, window + [now], timeout=3)
+            return True
         
-        # Remove old messages (older than 2 seconds)
-        cutoff_time = current_time - timedelta(seconds=2)
-        messages = [msg_time for msg_time in messages if msg_time > cutoff_time]
+        entry = uuid.uuid4().hex
+        # Sliding window log: drop entries older than 2 seconds, record this
+        # message and count the window in a single round-trip
+        with redis.pipeline() as pipe:
+            pipe.zremrangebyscore(cache_key, 0, now - 2)
+            pipe.zadd(cache_key, {entry: now})
+            pipe.zcard(cache_key)
+            pipe.expire(cache_key, 3)
+            _, _, count, _ = pipe.execute()
         
-        # Check if limit exceeded (3 messages per 2 seconds)
-        if len(messages) >= 3:
+        if count > 3:
+            # Rejected messages don't count against the window
+            redis.zrem(cache_key, entry)
             return False
         
-        # Add current message timestamp
-        messages.append(current_time)
-        cache.set(cache_key, messages, timeout=10)
-        
         return True
     
-    # Presence management
-    
-    async def add_user_presence(self):
-        """Add user to online presence set"""
-        cache_key = f'lobby_presence:{self.lobby_id}'
-        current_users = cache.get(cache_key, set())
-        current_users.add(self.user.id)
-        cache.set(cache_key, current_users, timeout=300)  # 5 minutes
-    
-    async def remove_user_presence(self):
-        """Remove user from online presence set"""
-        cache_key = f'lobby_presence:{self.lobby_id}'
-        current_users = cache.get(cache_key, set())
-        current_users.discard(self.user.id)
-        if current_users:
-            cache.set(cache_key, current_users, timeout=300)
-        else:
+    @sync_to_async(thread_sensitive=False)
+    def claim_typing_slot(self):
+        """Take the user's 400ms typing token; False while it is still held"""
+        cache_key = f'typing:{self.lobby_id}:{self.user.id}'
+        redis = get_redis()
+        if redis is None:
+            return cache.add(cache_key, 1, timeout=0.4)
+        return bool(redis.set(cache_key, 1, nx=True, px=400))
+    
+    @sync_to_async(thread_sensitive=False)
+    def release_typing_slot(self):
+        """Drop the user's typing token"""
+        cache_key = f'typing:{self.lobby_id}:{self.user.id}'
+        redis = get_redis()
+        if redis is None:
             cache.delete(cache_key)
+        else:
+            redis.delete(cache_key)
     
-    @database_sync_to_async
+    @sync_to_async(thread_sensitive=False)
+    def add_user_presence(self):
+        """Add user to online presence hash"""
+        cache_key = f'lobby_online:{self.lobby_id}'
+        # Store what presence_list needs so listing users needs no SQL
+        user_data = {
+            'username': self.user.username,
+            'is_premium': self.user.is_premium,
+        }
+        
+        redis = get_redis()
+        if redis is None:
+            online = cache.get(cache_key, {})
+            online[self.user.id] = user_data
+            cache.set(cache_key, online, timeout=300)
+            return
+        
+        with redis.pipeline() as pipe:
+            pipe.hset(cache_key, self.user.id, orjson.dumps(user_data))
+            pipe.expire(cache_key, 300)  # 5 minutes
+            pipe.execute()
+    
+    @sync_to_async(thread_sensitive=False)
+    def remove_user_presence(self):
+        """Remove user from online presence hash"""
+        cache_key = f'lobby_online:{self.lobby_id}'
+        
+        redis = get_redis()
+        if redis is None:
+            online = cache.get(cache_key, {})
+            online.pop(self.user.id, None)
+            if online:
+                cache.set(cache_key, online, timeout=300)
+            else:
+                cache.delete(cache_key)
+            return
+        
+        # Redis drops the key itself once the hash is empty
+        redis.hdel(cache_key, self.user.id)
+    
+    @sync_to_async(thread_sensitive=False)
     def get_online_users(self):
         """Get list of online users"""
-        cache_key = f'lobby_presence:{self.lobby_id}'
-        user_ids = cache.get(cache_key, set())
+        cache_key = f'lobby_online:{self.lobby_id}'
         
-        if not user_ids:
-            return []
+        redis = get_redis()
+        if redis is None:
+            return [
+                {'id': user_id, **user_data}
+                for user_id, user_data in cache.get(cache_key, {}).items()
+            ]
         
-        users = User.objects.filter(id__in=user_ids).values(
-            'id', 'username', 'is_premium'
+        online = redis.hgetall(cache_key)
+        return [
+            {'id': int(user_id), **orjson.loads(user_data)}
+            for user_id, user_data in online.items()
+        ]
+
+
+class MessageWriterConsumer(SyncConsumer):
+    """Background worker that persists chat messages and lobby events off the request path"""
+    
+    def save_message(self, event):
+        """Insert a chat message and tell the lobby its database id"""
+        try:
+            with transaction.atomic():
+                message = Message.objects.create(
+                    lobby_id=event['lobby_id'],
+                    sender_id=event['sender_id'],
+                    content=event['content']
+                )
+        except IntegrityError:
+            # Lobby or sender was deleted after the message was queued
+            return
+        
+        content = {
+            'type': 'message_saved',
+            'client_id': event['client_id'],
+            'id': message.id,
+            'created_at': message.created_at.isoformat(),
+        }
+        async_to_sync(self.channel_layer.group_send)(
+            f"lobby_{event['lobby_id']}",
+            {
+                'type': 'message_saved',
+                'payload': orjson.dumps(content).decode(),
+            }
         )
-        return list(users)
\ No newline at end of file
+    
+    def save_event(self, event):
+        """Insert a lobby audit event queued by the REST views"""
+        try:
+            with transaction.atomic():
+                LobbyEvent.objects.create(
+                    lobby_id=event['lobby_id'],
+                    event_type=event['event_type'],
+                    actor_id=event['actor_id'],
+                    target_id=event['target_id'],
+                    description=event['description'],
+                    metadata=event['metadata']
+                )
+        except IntegrityError:
+            # Lobby, actor or target was deleted after the event was queued
+            pass
@@ -0,0 +1,28 @@
+"""Hand inserts to the db-writes worker, writing inline when it can't take them"""
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+
+from .cache_keys import MESSAGE_WRITER_CHANNEL
+
+
+def queue_or_write(message_type, fields, write):
+    """Send fields to MessageWriterConsumer as a message_type event, or call write().
+    
+    The in-memory channel layer lives inside this process, so no worker can
+    read it, and a full channel means the worker is down or lagging. In both
+    cases write() runs here and its result is returned; otherwise None is
+    returned once the event is queued. Queued events are not durable:
+    channels_redis drops messages nobody reads within its expiry (60 seconds
+    by default), so they are lost if the worker stays down longer than that.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None or isinstance(channel_layer, InMemoryChannelLayer):
+        return write()
+    try:
+        async_to_sync(channel_layer.send)(
+            MESSAGE_WRITER_CHANNEL, {'type': message_type, **fields}
+        )
+    except ChannelFull:
+        return write()
+    return None
@@ -1,6 +1,8 @@
 import random
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from chat.models import Lobby, LobbyMembership, Message, LobbyBan, LobbyEvent
 
 User = get_user_model()
@@ -16,6 +18,7 @@ class Command(BaseCommand):
             help='Clear existing data before seeding',
         )
 
+    @transaction.atomic
     def handle(self, *args, **options):
         if options['clear']:
             self.stdout.write('Clearing existing data...')
@@ -83,26 +86,24 @@ class Command(BaseCommand):
             }
         ]
 
+        # Memberships and events are collected here and bulk-created below
+        memberships = []
+        events = []
+        
         lobbies = []
         for data in lobby_data:
+            # Lobby.save() also creates the owner membership
             lobby = Lobby.objects.create(**data)
             lobbies.append(lobby)
             
-            # Create owner membership
-            LobbyMembership.objects.create(
-                user=data['owner'],
-                lobby=lobby,
-                role='owner'
-            )
-            
             # Create event
-            LobbyEvent.objects.create(
+            events.append(LobbyEvent(
                 lobby=lobby,
                 event_type='status_change',
                 actor=data['owner'],
                 description=f"Lobby '{lobby.name}' created",
                 metadata={'status': lobby.status}
-            )
+            ))
             
             self.stdout.write(f'Created lobby: {lobby.name}')
 
@@ -112,32 +113,34 @@ class Command(BaseCommand):
         for lobby in lobbies:
             # Add 2-4 random members to each lobby
             members_to_add = random.sample(normal_users, random.randint(2, 4))
+            existing = {lobby.owner_id}
             
             for user in members_to_add:
-                if not LobbyMembership.objects.filter(user=user, lobby=lobby).exists():
+                if user.id not in existing:
+                    existing.add(user.id)
                     role = 'moderator' if random.random() < 0.3 else 'member'
-                    LobbyMembership.objects.create(
+                    memberships.append(LobbyMembership(
                         user=user,
                         lobby=lobby,
                         role=role
-                    )
+                    ))
                     
                     # Create join event
-                    LobbyEvent.objects.create(
+                    events.append(LobbyEvent(
                         lobby=lobby,
                         event_type='status_change',
                         actor=user,
                         description=f"{user.username} joined the lobby"
-                    )
+                    ))
                     
                     if role == 'moderator':
-                        LobbyEvent.objects.create(
+                        events.append(LobbyEvent(
                             lobby=lobby,
                             event_type='mod_add',
                             actor=lobby.owner,
                             target=user,
                             description=f"{user.username} promoted to moderator"
-                        )
+                        ))
 
         # Create some bans
         self.stdout.write('Creating some bans...')
@@ -147,7 +150,10 @@ class Command(BaseCommand):
         ban_lobby = lobbies[0]
         
         # Remove from lobby if member
-        LobbyMembership.objects.filter(user=banned_user, lobby=ban_lobby).delete()
+        memberships = [
+            membership for membership in memberships
+            if not (membership.user == banned_user and membership.lobby == ban_lobby)
+        ]
         
         LobbyBan.objects.create(
             lobby=ban_lobby,
@@ -156,14 +162,18 @@ class Command(BaseCommand):
             banned_by=ban_lobby.owner
         )
         
-        LobbyEvent.objects.create(
+        events.append(LobbyEvent(
             lobby=ban_lobby,
             event_type='ban',
             actor=ban_lobby.owner,
             target=banned_user,
             description=f"{banned_user.username} banned from lobby. Reason: Inappropriate behavior",
             metadata={'reason': 'Inappropriate behavior'}
-        )
+        ))
+
+        # Save memberships and events in one batch each
+        LobbyMembership.objects.bulk_create(memberships, batch_size=500)
+        LobbyEvent.objects.bulk_create(events, batch_size=500)
 
         # Create messages
         self.stdout.write('Creating messages...')
@@ -186,7 +196,13 @@ class Command(BaseCommand):
             "Looking forward to the next match",
         ]
         
-        message_count = 0
+        # Load every lobby's members in one query, users joined in
+        prefetch_related_objects(
+            lobbies,
+            Prefetch('memberships', queryset=LobbyMembership.objects.select_related('user'))
+        )
+        
+        messages = []
         for lobby in lobbies:
             # Get lobby members
             members = [membership.user for membership in lobby.memberships.all()]
@@ -205,13 +221,14 @@ class Command(BaseCommand):
                 if random.random() < 0.3:
                     content += f" @{random.choice(members).username}"
                 
-                Message.objects.create(
+                messages.append(Message(
                     lobby=lobby,
                     sender=sender,
                     content=content
-                )
-                
-                message_count += 1
+                ))
+        
+        Message.objects.bulk_create(messages, batch_size=500)
+        message_count = len(messages)
 
         # Create summary
         self.stdout.write('\n' + '='*50)
@@ -1,13 +1,20 @@
 from channels.middleware import BaseMiddleware
 from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connection
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from rest_framework_simplejwt.tokens import UntypedToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from urllib.parse import parse_qs
-import jwt
+from collections import Counter
+import hashlib
+import logging
+import time
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
 class JWTAuthMiddleware(BaseMiddleware):
@@ -24,16 +31,13 @@ class JWTAuthMiddleware(BaseMiddleware):
         
         if token:
             try:
-                # Validate token
-                UntypedToken(token)
-                # Decode token to get user
-                decoded_data = jwt.decode(
-                    token, 
-                    options={"verify_signature": False}
-                )
-                user_id = decoded_data.get('user_id')
+                # Validate token and read the already-decoded payload
+                payload = UntypedToken(token).payload
+                user_id = payload.get('user_id')
                 if user_id:
-                    scope['user'] = await self.get_user(user_id)
+                    scope['user'] = await self.get_user(
+                        user_id, token, payload.get('exp')
+                    )
                 else:
                     scope['user'] = AnonymousUser()
             except (InvalidToken, TokenError, KeyError):
@@ -44,13 +48,63 @@ class JWTAuthMiddleware(BaseMiddleware):
         return await super().__call__(scope, receive, send)
     
     @database_sync_to_async
-    def get_user(self, user_id):
+    def get_user(self, user_id, token, exp=None):
+        # Reconnects with the same token skip the DB for up to a minute
+        cache_key = f'wsjwt:{hashlib.sha256(token.encode()).hexdigest()}'
+        user = cache.get(cache_key)
+        if user is not None:
+            return user
+        
         try:
-            return User.objects.get(id=user_id)
+            # The consumer only reads identity and premium status
+            user = User.objects.only(
+                'id', 'username', 'is_premium', 'is_active'
+            ).get(id=user_id)
         except User.DoesNotExist:
             return AnonymousUser()
+        
+        timeout = 60
+        if exp:
+            timeout = min(timeout, int(exp - time.time()))
+        if timeout > 0:
+            cache.set(cache_key, user, timeout=timeout)
+        return user
 
 
 def JWTAuthMiddlewareStack(inner):
     """WebSocket middleware stack with JWT authentication"""
-    return JWTAuthMiddleware(inner)
\ No newline at end of file
+    return JWTAuthMiddleware(inner)
+
+
+class NPlusOneDetectorMiddleware:
+    """Development middleware that flags HTTP requests repeating the same SQL
+    
+    Each query is recorded by its parameterised SQL, so a loop issuing one
+    SELECT per row shows up as a single statement run many times. Requests
+    where any statement exceeds N_PLUS_ONE_THRESHOLD get an X-N-Plus-One
+    response header and a warning in the log. Only enabled when DEBUG is on.
+    """
+    
+    def __init__(self, get_response):
+        self.get_response = get_response
+    
+    def __call__(self, request):
+        statements = Counter()
+        
+        def record(execute, sql, params, many, context):
+            statements[sql] += 1
+            return execute(sql, params, many, context)
+        
+        with connection.execute_wrapper(record):
+            response = self.get_response(request)
+        
+        response['X-Query-Count'] = str(sum(statements.values()))
+        if statements:
+            sql, repeats = statements.most_common(1)[0]
+            if repeats > settings.N_PLUS_ONE_THRESHOLD:
+                response['X-N-Plus-One'] = str(repeats)
+                logger.warning(
+                    'Possible N+1 on %s %s: query ran %d times: %s',
+                    request.method, request.path, repeats, sql
+                )
+        return response
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.15 on 2026-10-14 04:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("chat", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="lobbymembership",
+            index=models.Index(
+                fields=["lobby", "user"], name="chat_lobbym_lobby_i_350164_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["lobby", "is_deleted", "-created_at"],
+                name="chat_messag_lobby_i_8c8e40_idx",
+            ),
+        ),
+    ]
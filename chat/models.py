@@ -1,7 +1,11 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Count, Exists, OuterRef
 from django.utils import timezone
 
+from .cache_keys import MEMBER_TIMEOUT, membership_key
+
 
 class User(AbstractUser):
     """Extended user model with premium status"""
@@ -36,23 +40,56 @@ class Lobby(models.Model):
     def __str__(self):
         return f"{self.name} ({self.owner.username})"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        # A new lobby always starts with its owner as a member
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            LobbyMembership.objects.create(user_id=self.owner_id, lobby=self, role='owner')
+
     @property
     def current_participants_count(self):
-        return self.memberships.count()
+        # LobbyViewSet annotates the count for list/detail responses; otherwise
+        # count once and keep it so is_full doesn't run a second COUNT
+        count = self.__dict__.get('_participants_count')
+        if count is None:
+            count = self._participants_count = self.memberships.count()
+        return count
 
     @property
     def is_full(self):
         return self.current_participants_count >= self.max_participants
 
     def can_join(self, user):
-        """Check if user can join this lobby"""
+        """Check if user can join this lobby.
+        
+        Covers status, capacity, bans and existing membership, so callers need
+        no separate IsNotBanned check.
+        """
         if self.status != 'open':
             return False, "Lobby is not open"
-        if self.is_full:
+        
+        if 'is_banned' in self.__dict__ and 'is_member' in self.__dict__:
+            # Annotated for this user by LobbyViewSet.get_queryset (join)
+            state = {
+                'participants': self.current_participants_count,
+                'is_banned': self.is_banned,
+                'is_member': self.is_member,
+            }
+        else:
+            # Participant count, ban and membership in a single query
+            state = Lobby.objects.filter(pk=self.pk).annotate(
+                participants=Count('memberships'),
+                is_banned=Exists(LobbyBan.objects.filter(lobby=OuterRef('pk'), user=user)),
+                is_member=Exists(LobbyMembership.objects.filter(lobby=OuterRef('pk'), user=user)),
+            ).values('participants', 'is_banned', 'is_member').get()
+        
+        if state['participants'] >= self.max_participants:
             return False, "Lobby is full"
-        if self.bans.filter(user=user).exists():
+        if state['is_banned']:
             return False, "You are banned from this lobby"
-        if self.memberships.filter(user=user).exists():
+        if state['is_member']:
             return False, "Already in lobby"
         return True, "Can join"
 
@@ -73,11 +110,24 @@ class LobbyMembership(models.Model):
     class Meta:
         unique_together = ['user', 'lobby']
         ordering = ['joined_at']
+        indexes = [
+            # unique_together covers (user, lobby); this serves lobby-first lookups
+            models.Index(fields=['lobby', 'user']),
+        ]
 
     def __str__(self):
         return f"{self.user.username} in {self.lobby.name} ({self.role})"
 
 
+def is_lobby_member(lobby_id, user_id):
+    """Cached membership check; signals drop the flag whenever the membership changes"""
+    return cache.get_or_set(
+        membership_key(lobby_id, user_id),
+        lambda: LobbyMembership.objects.filter(lobby_id=lobby_id, user_id=user_id).exists(),
+        MEMBER_TIMEOUT
+    )
+
+
 class LobbyBan(models.Model):
     """Banned users from a lobby"""
     lobby = models.ForeignKey(Lobby, on_delete=models.CASCADE, related_name='bans')
@@ -104,6 +154,10 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Recent message feed: lobby + visible, newest first
+            models.Index(fields=['lobby', 'is_deleted', '-created_at']),
+        ]
 
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}"
@@ -1,6 +1,45 @@
+import logging
+
 from rest_framework import permissions
 from .models import LobbyMembership, LobbyBan
 
+logger = logging.getLogger(__name__)
+
+_MOD_ROLES = frozenset(('moderator', 'owner'))
+
+
+def _lobby_perm_cache(request, lobby_id):
+    """Per-request memo so stacked permission classes share lobby lookups"""
+    cache = request.__dict__.setdefault('_lobby_perm_cache', {})
+    return cache.setdefault(lobby_id, {})
+
+
+def _get_role(request, lobby_id, obj=None):
+    """Role of the requesting user in the lobby, or None if not a member.
+    
+    Uses the user_role annotation when the view put one on the lobby.
+    """
+    entry = _lobby_perm_cache(request, lobby_id)
+    if 'role' not in entry and obj is not None and 'user_role' in obj.__dict__:
+        entry['role'] = obj.user_role
+    if 'role' not in entry:
+        entry['role'] = LobbyMembership.objects.filter(
+            lobby_id=lobby_id,
+            user=request.user
+        ).values_list('role', flat=True).first()
+    return entry['role']
+
+
+def _is_banned(request, lobby_id):
+    """Whether the requesting user is banned from the lobby"""
+    entry = _lobby_perm_cache(request, lobby_id)
+    if 'banned' not in entry:
+        entry['banned'] = LobbyBan.objects.filter(
+            lobby_id=lobby_id,
+            user=request.user
+        ).exists()
+    return entry['banned']
+
 
 class IsPremium(permissions.BasePermission):
     """Permission to check if user has premium status"""
@@ -17,31 +56,24 @@ class IsOwnerOrModerator(permissions.BasePermission):
     """Permission to check if user is lobby owner or moderator"""
     
     def has_permission(self, request, view):
-        print(f"DEBUG has_permission: User {request.user.username} calling action {view.action}")
         return request.user and request.user.is_authenticated
     
     def has_object_permission(self, request, view, obj):
-        print(f"DEBUG has_object_permission: User {request.user.username} on lobby {obj.id}")
         if not request.user.is_authenticated:
             return False
         
         # Check if user is owner
-        if obj.owner == request.user:
-            print(f"DEBUG: User {request.user.username} is owner")
+        if obj.owner_id == request.user.id:
             return True
         
         # Check if user is moderator
-        try:
-            membership = LobbyMembership.objects.get(
-                lobby=obj, 
-                user=request.user
-            )
-            is_moderator = membership.role in ['moderator', 'owner']
-            print(f"DEBUG: User {request.user.username} role: {membership.role}, is_moderator: {is_moderator}")
-            return is_moderator
-        except LobbyMembership.DoesNotExist:
-            print(f"DEBUG: User {request.user.username} not found in lobby {obj.id}")
-            return False
+        role = _get_role(request, obj.id, obj)
+        is_moderator = role in _MOD_ROLES
+        logger.debug(
+            "User %s role in lobby %s: %s (moderator: %s)",
+            request.user.username, obj.id, role, is_moderator
+        )
+        return is_moderator
 
 
 class IsLobbyOwner(permissions.BasePermission):
@@ -51,7 +83,7 @@ class IsLobbyOwner(permissions.BasePermission):
         return (
             request.user 
             and request.user.is_authenticated 
-            and obj.owner == request.user
+            and obj.owner_id == request.user.id
         )
 
 
@@ -75,10 +107,7 @@ class IsNotBanned(permissions.BasePermission):
         if not request.user.is_authenticated:
             return False
         
-        is_banned = LobbyBan.objects.filter(
-            lobby=obj, 
-            user=request.user
-        ).exists()
+        is_banned = _is_banned(request, obj.id)
         
         if is_banned:
             self.message = "You are banned from this lobby"
@@ -86,16 +115,15 @@ class IsNotBanned(permissions.BasePermission):
 
 
 class IsLobbyMember(permissions.BasePermission):
-    """Permission to check if user is a member of the lobby"""
+    """Permission to check if user is a member of the lobby (or the message's lobby)"""
     
     def has_object_permission(self, request, view, obj):
         if not request.user.is_authenticated:
             return False
         
-        is_member = LobbyMembership.objects.filter(
-            lobby=obj,
-            user=request.user
-        ).exists()
+        # MessageViewSet passes a Message; its lobby is lobby_id, not its own id
+        lobby_id = getattr(obj, 'lobby_id', obj.id)
+        is_member = _get_role(request, lobby_id, obj) is not None
         
         if not is_member:
             self.message = "You must be a member of this lobby"
@@ -109,7 +137,7 @@ class IsMessageSender(permissions.BasePermission):
         return (
             request.user 
             and request.user.is_authenticated 
-            and obj.sender == request.user
+            and obj.sender_id == request.user.id
         )
 
 
@@ -121,15 +149,9 @@ class CanModerateMessage(permissions.BasePermission):
             return False
         
         # Message sender can delete their own message
-        if obj.sender == request.user:
+        if obj.sender_id == request.user.id:
             return True
         
         # Lobby owner or moderator can delete any message
-        try:
-            membership = LobbyMembership.objects.get(
-                lobby=obj.lobby,
-                user=request.user
-            )
-            return membership.role in ['moderator', 'owner']
-        except LobbyMembership.DoesNotExist:
-            return False
\ No newline at end of file
+        role = _get_role(request, obj.lobby_id)
+        return role in _MOD_ROLES
\ No newline at end of file
@@ -1,12 +1,20 @@
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
 from .models import User, Lobby, LobbyMembership, LobbyBan, Message, LobbyEvent
 
 
+def _validate_user_exists(value):
+    """Validate that a user with the given id exists without loading it"""
+    if not User.objects.filter(id=value).exists():
+        raise serializers.ValidationError("User not found")
+    return value
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     """User registration serializer"""
-    password = serializers.CharField(write_only=True, validators=[validate_password])
+    password = serializers.CharField(write_only=True)
     password_confirm = serializers.CharField(write_only=True)
 
     class Meta:
@@ -16,6 +24,11 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     def validate(self, attrs):
         if attrs['password'] != attrs['password_confirm']:
             raise serializers.ValidationError("Passwords don't match")
+        # Password strength runs only once the cheap confirmation check passed
+        try:
+            validate_password(attrs['password'])
+        except DjangoValidationError as e:
+            raise serializers.ValidationError({'password': list(e.messages)})
         return attrs
 
     def create(self, validated_data):
@@ -37,6 +50,15 @@ class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'is_premium')
+    
+    def to_representation(self, instance):
+        # The same users repeat across memberships, messages and events of
+        # one response, so build each user's dict once per serializer context
+        user_cache = self.context.setdefault('_user_cache', {})
+        data = user_cache.get(instance.pk)
+        if data is None:
+            data = user_cache[instance.pk] = super().to_representation(instance)
+        return data
 
 
 class LobbyMembershipSerializer(serializers.ModelSerializer):
@@ -68,9 +90,10 @@ class MessageSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'sender', 'created_at')
 
     def validate_content(self, value):
-        if len(value.strip()) == 0:
+        # CharField(trim_whitespace=True) has already stripped the value
+        if not value:
             raise serializers.ValidationError("Message cannot be empty")
-        return value.strip()
+        return value
 
 
 class LobbyListSerializer(serializers.ModelSerializer):
@@ -94,7 +117,7 @@ class LobbyDetailSerializer(serializers.ModelSerializer):
     memberships = LobbyMembershipSerializer(many=True, read_only=True)
     current_participants_count = serializers.ReadOnlyField()
     is_full = serializers.ReadOnlyField()
-    recent_messages = serializers.SerializerMethodField()
+    recent_messages = MessageSerializer(many=True, read_only=True, source='recent_messages_list')
     
     class Meta:
         model = Lobby
@@ -104,10 +127,6 @@ class LobbyDetailSerializer(serializers.ModelSerializer):
             'is_full', 'memberships', 'recent_messages',
             'created_at', 'updated_at'
         )
-    
-    def get_recent_messages(self, obj):
-        recent_messages = obj.messages.filter(is_deleted=False)[:50]
-        return MessageSerializer(recent_messages, many=True).data
 
 
 class LobbyCreateSerializer(serializers.ModelSerializer):
@@ -117,9 +136,10 @@ class LobbyCreateSerializer(serializers.ModelSerializer):
         fields = ('name', 'is_public', 'max_participants')
     
     def validate_name(self, value):
-        if len(value.strip()) < 3:
+        stripped = value.strip()
+        if len(stripped) < 3:
             raise serializers.ValidationError("Lobby name must be at least 3 characters long")
-        return value.strip()
+        return stripped
     
     def validate_max_participants(self, value):
         if value < 2 or value > 50:
@@ -134,9 +154,12 @@ class LobbyUpdateSerializer(serializers.ModelSerializer):
         fields = ('name', 'status', 'max_participants')
     
     def validate_name(self, value):
-        if value and len(value.strip()) < 3:
+        if not value:
+            return value
+        stripped = value.strip()
+        if len(stripped) < 3:
             raise serializers.ValidationError("Lobby name must be at least 3 characters long")
-        return value.strip() if value else value
+        return stripped
     
     def validate_max_participants(self, value):
         if value and (value < 2 or value > 50):
@@ -150,11 +173,7 @@ class KickUserSerializer(serializers.Serializer):
     reason = serializers.CharField(required=False, allow_blank=True, max_length=500)
     
     def validate_user_id(self, value):
-        try:
-            User.objects.get(id=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("User not found")
-        return value
+        return _validate_user_exists(value)
 
 
 class BanUserSerializer(serializers.Serializer):
@@ -163,11 +182,7 @@ class BanUserSerializer(serializers.Serializer):
     reason = serializers.CharField(required=False, allow_blank=True, max_length=500)
     
     def validate_user_id(self, value):
-        try:
-            User.objects.get(id=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("User not found")
-        return value
+        return _validate_user_exists(value)
 
 
 class UnbanUserSerializer(serializers.Serializer):
@@ -175,11 +190,7 @@ class UnbanUserSerializer(serializers.Serializer):
     user_id = serializers.IntegerField()
     
     def validate_user_id(self, value):
-        try:
-            User.objects.get(id=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("User not found")
-        return value
+        return _validate_user_exists(value)
 
 
 class ModeratorSerializer(serializers.Serializer):
@@ -187,11 +198,7 @@ class ModeratorSerializer(serializers.Serializer):
     user_id = serializers.IntegerField()
     
     def validate_user_id(self, value):
-        try:
-            User.objects.get(id=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("User not found")
-        return value
+        return _validate_user_exists(value)
 
 
 class TransferOwnershipSerializer(serializers.Serializer):
@@ -199,11 +206,7 @@ class TransferOwnershipSerializer(serializers.Serializer):
     user_id = serializers.IntegerField()
     
     def validate_user_id(self, value):
-        try:
-            User.objects.get(id=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("User not found")
-        return value
+        return _validate_user_exists(value)
 
 
 class LobbyEventSerializer(serializers.ModelSerializer):
@@ -0,0 +1,36 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .cache_keys import lobby_key, can_join_key, membership_key
+from .models import Lobby, LobbyMembership, LobbyBan
+
+
+def delete_on_commit(*keys):
+    """Drop cache keys once the current transaction commits.
+    
+    Deleting straight away would let a concurrent reader cache the
+    not-yet-committed state again before the change is visible.
+    """
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver([post_save, post_delete], sender=Lobby)
+def invalidate_lobby_cache(sender, instance, **kwargs):
+    """Drop the cached lobby on status/settings change or delete"""
+    delete_on_commit(lobby_key(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=LobbyMembership)
+@receiver([post_save, post_delete], sender=LobbyBan)
+def invalidate_can_join_cache(sender, instance, **kwargs):
+    """Drop the cached join decision when a user joins, leaves, is kicked or banned"""
+    # Any other status is refused before membership and bans are looked at
+    delete_on_commit(can_join_key(instance.lobby_id, instance.user_id, 'open'))
+
+
+@receiver([post_save, post_delete], sender=LobbyMembership)
+def invalidate_membership_cache(sender, instance, **kwargs):
+    """Drop the cached membership flag used by the message send path"""
+    delete_on_commit(membership_key(instance.lobby_id, instance.user_id))
@@ -1,16 +1,22 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import authenticate
-from django.db import transaction
-from django.shortcuts import get_object_or_404
-from django.db.models import Q
-from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import Http404
+from django.db.models import Q, Count, Exists, Prefetch, OuterRef, Subquery
 from django.utils import timezone
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 
-from .models import User, Lobby, LobbyMembership, LobbyBan, Message, LobbyEvent
+from .models import User, Lobby, LobbyMembership, LobbyBan, Message, LobbyEvent, is_lobby_member
+from .cache_keys import lobby_key
+from .db_writes import queue_or_write
+from .signals import delete_on_commit
 from .serializers import (
     UserRegistrationSerializer, UserProfileSerializer, LobbyListSerializer,
     LobbyDetailSerializer, LobbyCreateSerializer, LobbyUpdateSerializer,
@@ -23,6 +29,40 @@ from .permissions import (
 )
 
 
+# Columns the moderation actions read or write on a membership; the lobby and
+# user ids are kept so the cache-invalidation signals don't refetch them
+MEMBERSHIP_ROLE_FIELDS = ('id', 'role', 'user_id', 'lobby_id')
+
+
+def log_lobby_event(lobby, event_type, actor, description, target=None, metadata=None):
+    """Record an audit event once the transaction commits, via the db-writes worker
+    when one can take it (see queue_or_write)"""
+    fields = {
+        'lobby_id': lobby.id,
+        'event_type': event_type,
+        'actor_id': actor.id,
+        'target_id': target.id if target is not None else None,
+        'description': description,
+        'metadata': metadata or {},
+    }
+    transaction.on_commit(lambda: queue_or_write(
+        'save_event', fields, lambda: LobbyEvent.objects.create(**fields)
+    ))
+
+
+def notify_lobby(lobby, event_type, target, reason=''):
+    """Push a moderation event to connected WebSocket clients of the lobby"""
+    async_to_sync(get_channel_layer().group_send)(
+        f'lobby_{lobby.id}',
+        {
+            'type': event_type,
+            'target_id': target.id,
+            'target_username': target.username,
+            'reason': reason,
+        }
+    )
+
+
 class UserRegistrationView(APIView):
     """User registration endpoint"""
     permission_classes = [permissions.AllowAny]
@@ -78,7 +118,8 @@ class LobbyViewSet(viewsets.ModelViewSet):
             return [permissions.IsAuthenticated(), IsLobbyOwner()]
         elif self.action == 'retrieve':
             return [permissions.IsAuthenticated()]
-        return [permissions.IsAuthenticated()]
+        # Custom actions declare their own permission_classes on @action
+        return super().get_permissions()
     
     def get_queryset(self):
         queryset = Lobby.objects.all()
@@ -99,18 +140,89 @@ class LobbyViewSet(viewsets.ModelViewSet):
                 Q(name__icontains=search) | Q(owner__username__icontains=search)
             )
         
+        if self.action in ['list', 'retrieve', 'join']:
+            # Read by Lobby.current_participants_count instead of a COUNT per lobby
+            queryset = queryset.annotate(_participants_count=Count('memberships'))
+        
+        if self.action == 'join':
+            # Lobby.can_join reads the requester's ban and membership from these
+            queryset = queryset.annotate(
+                is_banned=Exists(
+                    LobbyBan.objects.filter(lobby=OuterRef('pk'), user=self.request.user)
+                ),
+                is_member=Exists(
+                    LobbyMembership.objects.filter(lobby=OuterRef('pk'), user=self.request.user)
+                )
+            )
+        
+        if self.action == 'list':
+            # LobbyListSerializer reads only these columns and the owner's summary
+            queryset = queryset.select_related('owner').only(
+                'id', 'name', 'is_public', 'status', 'max_participants', 'created_at',
+                'owner__id', 'owner__username', 'owner__is_premium'
+            )
+        
+        if self.action in ['start', 'close']:
+            # The action's IsLobbyOwner check only reads owner_id; the status
+            # is written with update()
+            queryset = queryset.only('id', 'owner_id')
+        
+        if self.action in ['kick', 'ban', 'unban', 'add_moderator', 'remove_moderator']:
+            # IsOwnerOrModerator reads the requester's role from this annotation
+            queryset = queryset.annotate(
+                user_role=Subquery(
+                    LobbyMembership.objects.filter(
+                        lobby=OuterRef('pk'),
+                        user=self.request.user
+                    ).values('role')[:1]
+                )
+            )
+        
+        if self.action == 'retrieve':
+            # LobbyDetailSerializer reads recent_messages_list, so this prefetch is required
+            queryset = queryset.select_related('owner').prefetch_related(
+                Prefetch(
+                    'messages',
+                    queryset=Message.objects.filter(is_deleted=False)
+                    .select_related('sender').order_by('-created_at')[:50],
+                    to_attr='recent_messages_list'
+                ),
+                Prefetch(
+                    'memberships',
+                    queryset=LobbyMembership.objects.select_related('user')
+                )
+            )
+        
         return queryset.order_by('-created_at')
     
+    def get_object(self):
+        # ViewSet instances live for one request, so the lobby can be kept
+        if not hasattr(self, '_obj_cache'):
+            self._obj_cache = super().get_object()
+        return self._obj_cache
+    
+    def _set_status(self, lobby, new_status):
+        """Write the status with a single UPDATE instead of a full-row save()"""
+        Lobby.objects.filter(pk=lobby.pk).update(status=new_status, updated_at=timezone.now())
+        lobby.status = new_status
+        self._invalidate_cached_lobby(lobby)
+    
+    def _invalidate_cached_lobby(self, lobby):
+        """update() sends no post_save, so drop the consumer's cached lobby on commit"""
+        delete_on_commit(lobby_key(lobby.pk))
+    
+    def _get_target_membership(self, lobby, user_id):
+        """Membership of the action's target user with that user joined, or None"""
+        return LobbyMembership.objects.select_related('user').only(
+            *MEMBERSHIP_ROLE_FIELDS, 'user__id', 'user__username'
+        ).filter(user_id=user_id, lobby=lobby).first()
+    
+    @transaction.atomic
     def perform_create(self, serializer):
+        # Lobby.save() creates the owner membership
         lobby = serializer.save(owner=self.request.user)
-        # Create owner membership
-        LobbyMembership.objects.create(
-            user=self.request.user,
-            lobby=lobby,
-            role='owner'
-        )
         # Log event
-        LobbyEvent.objects.create(
+        log_lobby_event(
             lobby=lobby,
             event_type='status_change',
             actor=self.request.user,
@@ -119,6 +231,7 @@ class LobbyViewSet(viewsets.ModelViewSet):
         )
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def join(self, request, pk=None):
         """Join a lobby"""
         lobby = self.get_object()
@@ -131,73 +244,70 @@ class LobbyViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create membership
-        membership, created = LobbyMembership.objects.get_or_create(
-            user=request.user,
-            lobby=lobby,
-            defaults={'role': 'member'}
-        )
-        
-        if created:
-            # Log event
-            LobbyEvent.objects.create(
-                lobby=lobby,
-                event_type='status_change',
-                actor=request.user,
-                description=f"{request.user.username} joined the lobby"
+        # can_join already ruled out an existing membership; a concurrent
+        # join of the same user still trips the unique constraint
+        try:
+            with transaction.atomic():
+                LobbyMembership.objects.create(user=request.user, lobby=lobby, role='member')
+        except IntegrityError:
+            return Response(
+                {"error": "Already in lobby"}, 
+                status=status.HTTP_400_BAD_REQUEST
             )
-            return Response({"message": "Joined lobby successfully"})
         
-        return Response(
-            {"error": "Already in lobby"}, 
-            status=status.HTTP_400_BAD_REQUEST
+        # Log event
+        log_lobby_event(
+            lobby=lobby,
+            event_type='status_change',
+            actor=request.user,
+            description=f"{request.user.username} joined the lobby"
         )
+        return Response({"message": "Joined lobby successfully"})
     
     @action(detail=True, methods=['post'])
+    @transaction.atomic
     def leave(self, request, pk=None):
         """Leave a lobby"""
         lobby = self.get_object()
         
-        try:
-            membership = LobbyMembership.objects.get(
-                user=request.user, 
-                lobby=lobby
-            )
-            
-            # Owner cannot leave, must transfer ownership first
-            if membership.role == 'owner':
-                return Response(
-                    {"error": "Owner cannot leave lobby. Transfer ownership first."},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            membership.delete()
-            
-            # Log event
-            LobbyEvent.objects.create(
-                lobby=lobby,
-                event_type='status_change',
-                actor=request.user,
-                description=f"{request.user.username} left the lobby"
+        membership = LobbyMembership.objects.only(*MEMBERSHIP_ROLE_FIELDS).filter(
+            user=request.user, 
+            lobby=lobby
+        ).first()
+        if membership is None:
+            return Response(
+                {"error": "Not in lobby"}, 
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-            return Response({"message": "Left lobby successfully"})
         
-        except LobbyMembership.DoesNotExist:
+        # Owner cannot leave, must transfer ownership first
+        if membership.role == 'owner':
             return Response(
-                {"error": "Not in lobby"}, 
+                {"error": "Owner cannot leave lobby. Transfer ownership first."},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        
+        membership.delete()
+        
+        # Log event
+        log_lobby_event(
+            lobby=lobby,
+            event_type='status_change',
+            actor=request.user,
+            description=f"{request.user.username} left the lobby"
+        )
+        
+        return Response({"message": "Left lobby successfully"})
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsLobbyOwner])
+    @transaction.atomic
     def start(self, request, pk=None):
         """Start the game (change status to in_game)"""
         lobby = self.get_object()
-        lobby.status = 'in_game'
-        lobby.save()
+        self._set_status(lobby, 'in_game')
         
         # Log event
-        LobbyEvent.objects.create(
+        log_lobby_event(
             lobby=lobby,
             event_type='status_change',
             actor=request.user,
@@ -208,14 +318,14 @@ class LobbyViewSet(viewsets.ModelViewSet):
         return Response({"message": "Game started"})
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsLobbyOwner])
+    @transaction.atomic
     def close(self, request, pk=None):
         """Close the lobby"""
         lobby = self.get_object()
-        lobby.status = 'closed'
-        lobby.save()
+        self._set_status(lobby, 'closed')
         
         # Log event
-        LobbyEvent.objects.create(
+        log_lobby_event(
             lobby=lobby,
             event_type='status_change',
             actor=request.user,
@@ -226,107 +336,102 @@ class LobbyViewSet(viewsets.ModelViewSet):
         return Response({"message": "Lobby closed"})
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsOwnerOrModerator])
+    @transaction.atomic
     def kick(self, request, pk=None):
         """Kick a user from lobby"""
         lobby = self.get_object()
-        print(f"KICK DEBUG: User {request.user.username} trying to kick from lobby {lobby.id}")
-        self.check_object_permissions(request, lobby)
-        print(f"KICK DEBUG: Permission check passed")
         serializer = KickUserSerializer(data=request.data)
         
         if serializer.is_valid():
             user_id = serializer.validated_data['user_id']
             reason = serializer.validated_data.get('reason', '')
             
-            try:
-                user = User.objects.get(id=user_id)
-                membership = LobbyMembership.objects.get(user=user, lobby=lobby)
-                
-                # Cannot kick owner
-                if membership.role == 'owner':
-                    return Response(
-                        {"error": "Cannot kick lobby owner"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                membership.delete()
-                
-                # Log event
-                LobbyEvent.objects.create(
-                    lobby=lobby,
-                    event_type='kick',
-                    actor=request.user,
-                    target=user,
-                    description=f"{user.username} kicked from lobby. Reason: {reason}",
-                    metadata={'reason': reason}
-                )
-                
-                return Response({"message": f"User {user.username} kicked successfully"})
-                
-            except User.DoesNotExist:
+            membership = self._get_target_membership(lobby, user_id)
+            if membership is None:
                 return Response(
-                    {"error": "User not found"},
-                    status=status.HTTP_404_NOT_FOUND
+                    {"error": "User not in lobby"},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-            except LobbyMembership.DoesNotExist:
+            user = membership.user
+            
+            # Cannot kick owner
+            if membership.role == 'owner':
                 return Response(
-                    {"error": "User not in lobby"},
+                    {"error": "Cannot kick lobby owner"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            
+            membership.delete()
+            
+            # Log event
+            log_lobby_event(
+                lobby=lobby,
+                event_type='kick',
+                actor=request.user,
+                target=user,
+                description=f"{user.username} kicked from lobby. Reason: {reason}",
+                metadata={'reason': reason}
+            )
+            
+            transaction.on_commit(lambda: notify_lobby(lobby, 'moderation_kick', user, reason))
+            
+            return Response({"message": f"User {user.username} kicked successfully"})
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsOwnerOrModerator])
+    @transaction.atomic
     def ban(self, request, pk=None):
         """Ban a user from lobby"""
         lobby = self.get_object()
-        self.check_object_permissions(request, lobby)
         serializer = BanUserSerializer(data=request.data)
         
         if serializer.is_valid():
             user_id = serializer.validated_data['user_id']
             reason = serializer.validated_data.get('reason', '')
             
+            # Cannot ban owner; owner_id is already on the lobby row
+            if lobby.owner_id == user_id:
+                return Response(
+                    {"error": "Cannot ban lobby owner"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
             try:
-                user = User.objects.get(id=user_id)
+                user = User.objects.only('id', 'username').get(id=user_id)
                 
-                # Cannot ban owner
-                if lobby.owner == user:
+                # Create ban record; the unique (lobby, user) constraint
+                # answers "already banned" without a prior SELECT
+                try:
+                    with transaction.atomic():
+                        LobbyBan.objects.create(
+                            lobby=lobby,
+                            user=user,
+                            reason=reason,
+                            banned_by=request.user
+                        )
+                except IntegrityError:
                     return Response(
-                        {"error": "Cannot ban lobby owner"},
+                        {"error": "User already banned"},
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 
                 # Remove from lobby if member
                 LobbyMembership.objects.filter(user=user, lobby=lobby).delete()
                 
-                # Create ban record
-                ban, created = LobbyBan.objects.get_or_create(
+                # Log event
+                log_lobby_event(
                     lobby=lobby,
-                    user=user,
-                    defaults={
-                        'reason': reason,
-                        'banned_by': request.user
-                    }
+                    event_type='ban',
+                    actor=request.user,
+                    target=user,
+                    description=f"{user.username} banned from lobby. Reason: {reason}",
+                    metadata={'reason': reason}
                 )
                 
-                if created:
-                    # Log event
-                    LobbyEvent.objects.create(
-                        lobby=lobby,
-                        event_type='ban',
-                        actor=request.user,
-                        target=user,
-                        description=f"{user.username} banned from lobby. Reason: {reason}",
-                        metadata={'reason': reason}
-                    )
-                    
-                    return Response({"message": f"User {user.username} banned successfully"})
-                else:
-                    return Response(
-                        {"error": "User already banned"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+                transaction.on_commit(lambda: notify_lobby(lobby, 'moderation_ban', user, reason))
+                
+                return Response({"message": f"User {user.username} banned successfully"})
                 
             except User.DoesNotExist:
                 return Response(
@@ -337,22 +442,22 @@ class LobbyViewSet(viewsets.ModelViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated, IsOwnerOrModerator])
+    @transaction.atomic
     def unban(self, request, pk=None):
         """Unban a user from lobby"""
         lobby = self.get_object()
-        self.check_object_permissions(request, lobby)
         serializer = UnbanUserSerializer(data=request.data)
         
         if serializer.is_valid():
             user_id = serializer.validated_data['user_id']
             
             try:
-                user = User.objects.get(id=user_id)
+                user = User.objects.only('id', 'username').get(id=user_id)
                 ban = LobbyBan.objects.get(lobby=lobby, user=user)
                 ban.delete()
                 
                 # Log event
-                LobbyEvent.objects.create(
+                log_lobby_event(
                     lobby=lobby,
                     event_type='unban',
                     actor=request.user,
@@ -379,46 +484,38 @@ class LobbyViewSet(viewsets.ModelViewSet):
     def add_moderator(self, request, pk=None):
         """Add moderator to lobby"""
         lobby = self.get_object()
-        self.check_object_permissions(request, lobby)
         serializer = ModeratorSerializer(data=request.data)
         
         if serializer.is_valid():
             user_id = serializer.validated_data['user_id']
             
-            try:
-                user = User.objects.get(id=user_id)
-                membership = LobbyMembership.objects.get(user=user, lobby=lobby)
-                
-                if membership.role == 'owner':
-                    return Response(
-                        {"error": "Owner is already a moderator"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                membership.role = 'moderator'
-                membership.save()
-                
-                # Log event
-                LobbyEvent.objects.create(
-                    lobby=lobby,
-                    event_type='mod_add',
-                    actor=request.user,
-                    target=user,
-                    description=f"{user.username} promoted to moderator"
-                )
-                
-                return Response({"message": f"User {user.username} promoted to moderator"})
-                
-            except User.DoesNotExist:
+            membership = self._get_target_membership(lobby, user_id)
+            if membership is None:
                 return Response(
-                    {"error": "User not found"},
-                    status=status.HTTP_404_NOT_FOUND
+                    {"error": "User not in lobby"},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-            except LobbyMembership.DoesNotExist:
+            user = membership.user
+            
+            if membership.role == 'owner':
                 return Response(
-                    {"error": "User not in lobby"},
+                    {"error": "Owner is already a moderator"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            
+            membership.role = 'moderator'
+            membership.save(update_fields=['role'])
+            
+            # Log event
+            log_lobby_event(
+                lobby=lobby,
+                event_type='mod_add',
+                actor=request.user,
+                target=user,
+                description=f"{user.username} promoted to moderator"
+            )
+            
+            return Response({"message": f"User {user.username} promoted to moderator"})
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -426,46 +523,38 @@ class LobbyViewSet(viewsets.ModelViewSet):
     def remove_moderator(self, request, pk=None):
         """Remove moderator from lobby"""
         lobby = self.get_object()
-        self.check_object_permissions(request, lobby)
         serializer = ModeratorSerializer(data=request.data)
         
         if serializer.is_valid():
             user_id = serializer.validated_data['user_id']
             
-            try:
-                user = User.objects.get(id=user_id)
-                membership = LobbyMembership.objects.get(user=user, lobby=lobby)
-                
-                if membership.role != 'moderator':
-                    return Response(
-                        {"error": "User is not a moderator"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                membership.role = 'member'
-                membership.save()
-                
-                # Log event
-                LobbyEvent.objects.create(
-                    lobby=lobby,
-                    event_type='mod_remove',
-                    actor=request.user,
-                    target=user,
-                    description=f"{user.username} demoted from moderator"
-                )
-                
-                return Response({"message": f"User {user.username} demoted from moderator"})
-                
-            except User.DoesNotExist:
+            membership = self._get_target_membership(lobby, user_id)
+            if membership is None:
                 return Response(
-                    {"error": "User not found"},
-                    status=status.HTTP_404_NOT_FOUND
+                    {"error": "User not in lobby"},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
-            except LobbyMembership.DoesNotExist:
+            user = membership.user
+            
+            if membership.role != 'moderator':
                 return Response(
-                    {"error": "User not in lobby"},
+                    {"error": "User is not a moderator"},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            
+            membership.role = 'member'
+            membership.save(update_fields=['role'])
+            
+            # Log event
+            log_lobby_event(
+                lobby=lobby,
+                event_type='mod_remove',
+                actor=request.user,
+                target=user,
+                description=f"{user.username} demoted from moderator"
+            )
+            
+            return Response({"message": f"User {user.username} demoted from moderator"})
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -473,62 +562,60 @@ class LobbyViewSet(viewsets.ModelViewSet):
     def transfer_ownership(self, request, pk=None):
         """Transfer ownership of lobby"""
         lobby = self.get_object()
-        self.check_object_permissions(request, lobby)
         serializer = TransferOwnershipSerializer(data=request.data)
         
         if serializer.is_valid():
             user_id = serializer.validated_data['user_id']
             
-            try:
-                user = User.objects.get(id=user_id)
-                membership = LobbyMembership.objects.get(user=user, lobby=lobby)
-                
-                with transaction.atomic():
-                    # Update lobby owner
-                    old_owner = lobby.owner
-                    lobby.owner = user
-                    lobby.save()
-                    
-                    # Update memberships
-                    old_owner_membership = LobbyMembership.objects.get(
-                        user=old_owner, 
-                        lobby=lobby
-                    )
-                    old_owner_membership.role = 'member'
-                    old_owner_membership.save()
-                    
-                    membership.role = 'owner'
-                    membership.save()
-                    
-                    # Log event
-                    LobbyEvent.objects.create(
-                        lobby=lobby,
-                        event_type='transfer',
-                        actor=request.user,
-                        target=user,
-                        description=f"Ownership transferred to {user.username}"
+            with transaction.atomic():
+                # Old and new owner memberships in one locked read
+                memberships = list(
+                    LobbyMembership.objects.select_for_update(of=('self',))
+                    .select_related('user')
+                    .only(*MEMBERSHIP_ROLE_FIELDS, 'user__id', 'user__username')
+                    .filter(lobby=lobby, user_id__in=[lobby.owner_id, user_id])
+                )
+                membership = next((m for m in memberships if m.user_id == user_id), None)
+                if membership is None:
+                    return Response(
+                        {"error": "User not in lobby"},
+                        status=status.HTTP_400_BAD_REQUEST
                     )
+                user = membership.user
                 
-                return Response({"message": f"Ownership transferred to {user.username}"})
+                for m in memberships:
+                    m.role = 'owner' if m.user_id == user_id else 'member'
+                LobbyMembership.objects.bulk_update(memberships, ['role'])
                 
-            except User.DoesNotExist:
-                return Response(
-                    {"error": "User not found"},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-            except LobbyMembership.DoesNotExist:
-                return Response(
-                    {"error": "User not in lobby"},
-                    status=status.HTTP_400_BAD_REQUEST
+                Lobby.objects.filter(pk=lobby.pk).update(owner_id=user_id, updated_at=timezone.now())
+                lobby.owner_id = user_id
+                self._invalidate_cached_lobby(lobby)
+                
+                # Log event
+                log_lobby_event(
+                    lobby=lobby,
+                    event_type='transfer',
+                    actor=request.user,
+                    target=user,
+                    description=f"Ownership transferred to {user.username}"
                 )
+            
+            return Response({"message": f"Ownership transferred to {user.username}"})
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class MessageCursorPagination(CursorPagination):
+    """Keyset pagination over the (lobby, is_deleted, -created_at) index"""
+    ordering = '-created_at'
+    page_size = 50
+
+
 class MessageViewSet(viewsets.ModelViewSet):
     """Message CRUD operations"""
     serializer_class = MessageSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageCursorPagination
     
     def get_queryset(self):
         lobby_id = self.kwargs.get('lobby_pk')
@@ -536,6 +623,9 @@ class MessageViewSet(viewsets.ModelViewSet):
             return Message.objects.filter(
                 lobby_id=lobby_id,
                 is_deleted=False
+            ).select_related('sender').only(
+                'id', 'lobby_id', 'content', 'created_at', 'is_deleted',
+                'sender__id', 'sender__username', 'sender__is_premium'
             ).order_by('-created_at')
         return Message.objects.none()
     
@@ -546,18 +636,17 @@ class MessageViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         lobby_id = self.kwargs.get('lobby_pk')
-        lobby = get_object_or_404(Lobby, id=lobby_id)
         
-        # Check if user is member
-        if not LobbyMembership.objects.filter(
-            user=self.request.user, 
-            lobby=lobby
-        ).exists():
-            raise permissions.PermissionDenied("Must be lobby member to send messages")
+        # Check if user is member; only a failed check needs to tell a
+        # missing lobby apart from a non-member
+        if not is_lobby_member(lobby_id, self.request.user.id):
+            if not Lobby.objects.filter(id=lobby_id).exists():
+                raise Http404
+            raise PermissionDenied("Must be lobby member to send messages")
         
-        serializer.save(sender=self.request.user, lobby=lobby)
+        serializer.save(sender=self.request.user, lobby_id=lobby_id)
     
     def perform_destroy(self, instance):
         # Soft delete
         instance.is_deleted = True
-        instance.save()
+        instance.save(update_fields=['is_deleted'])
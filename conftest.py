@@ -0,0 +1,28 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Start every test with an empty cache; rolled-back rows may reuse cached ids"""
+    from django.core.cache import cache
+    cache.clear()
+
+
+@pytest.fixture(scope='session')
+def asgi_app():
+    """Project ASGI application, built once and shared by WebSocket tests"""
+    from premiumchat.asgi import application
+    return application
+
+
+@pytest.fixture
+def lobby_communicator(asgi_app):
+    """Build a WebsocketCommunicator for a lobby, authenticated as the given user"""
+    from channels.testing import WebsocketCommunicator
+    from rest_framework_simplejwt.tokens import AccessToken
+    
+    def make_communicator(lobby_id, user):
+        token = str(AccessToken.for_user(user))
+        return WebsocketCommunicator(asgi_app, f'/ws/lobbies/{lobby_id}/?token={token}')
+    
+    return make_communicator
@@ -9,9 +9,11 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.routing import ProtocolTypeRouter, URLRouter, ChannelNameRouter
 from channels.auth import AuthMiddlewareStack
 import chat.routing
+from chat.cache_keys import MESSAGE_WRITER_CHANNEL
+from chat.consumers import MessageWriterConsumer
 from chat.middleware import JWTAuthMiddlewareStack
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'premiumchat.settings')
@@ -25,4 +27,7 @@ application = ProtocolTypeRouter({
             chat.routing.websocket_urlpatterns
         )
     ),
+    "channel": ChannelNameRouter({
+        MESSAGE_WRITER_CHANNEL: MessageWriterConsumer.as_asgi(),
+    }),
 })
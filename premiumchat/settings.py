@@ -62,6 +62,12 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Flag requests that run the same SQL statement more than
+# N_PLUS_ONE_THRESHOLD times (X-N-Plus-One response header)
+N_PLUS_ONE_THRESHOLD = config('N_PLUS_ONE_THRESHOLD', default=3, cast=int)
+if DEBUG:
+    MIDDLEWARE += ['chat.middleware.NPlusOneDetectorMiddleware']
+
 ROOT_URLCONF = 'premiumchat.urls'
 
 TEMPLATES = [
@@ -163,13 +169,6 @@ SIMPLE_JWT = {
     'ROTATE_REFRESH_TOKENS': True,
 }
 
-# Channels Configuration - Using in-memory for testing (no Redis required)
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-    },
-}
-
 # CORS Settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -179,13 +178,47 @@ CORS_ALLOWED_ORIGINS = [
 
 CORS_ALLOW_CREDENTIALS = True
 
-# Simple cache backend for development (no Redis required)
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# Cache backend - Redis when REDIS_URL is set, local memory otherwise.
+# WebSocket presence uses native Redis commands, so the ASGI app needs REDIS_URL.
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        }
+    }
+else:
+    # Simple cache backend for development (no Redis required)
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'unique-snowflake',
+        }
+    }
+
+# Channels Configuration - Redis when REDIS_URL is set, in-memory for testing.
+# Chat messages are persisted by a separate worker process
+# (python manage.py runworker db-writes), which needs the Redis layer.
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL],
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
     }
-}
 
 # Session settings - use database sessions instead of cache
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
@@ -0,0 +1,12 @@
+"""
+Test settings for premiumchat project.
+
+Used by pytest through pytest.ini; everything else comes from settings.py.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+# PBKDF2 is deliberately slow; tests only need hashes that verify
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+]